@@ -5,14 +5,28 @@ This module extracts structured room/feature data from architectural floorplan i
 using DSPy for programming language models and GEPA for prompt optimization.
 """
 
+import hashlib
+import html
+import json
+import os
 import re
-import xml.etree.ElementTree as ET
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from enum import Enum
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 
 import dspy
-from pydantic import BaseModel
+from gepa.utils import NoImprovementStopper
+from lxml import etree as ET
+from pydantic import BaseModel, ConfigDict
+
+try:
+    from orjson import loads as _json_loads
+except ImportError:  # orjson is optional; stdlib json is just slower
+    _json_loads = json.loads
 
 
 # =============================================================================
@@ -35,6 +49,9 @@ PROVIDER_MODELS = {
     LLMProvider.OPENROUTER: "openrouter/google/gemini-2.5-flash",
 }
 
+# Persistent on-disk cache for LM responses
+LLM_CACHE_DIR = Path.home() / ".cache" / "floorplan"
+
 
 def configure_llm(provider: LLMProvider, model: str | None = None) -> dspy.LM:
     """Configure DSPy with the specified LLM provider.
@@ -47,12 +64,33 @@ def configure_llm(provider: LLMProvider, model: str | None = None) -> dspy.LM:
         Configured dspy.LM instance
     """
     model_name = model or PROVIDER_MODELS[provider]
-    lm = dspy.LM(
+    lm = _build_lm(model_name)
+    dspy.configure(lm=lm)
+
+    # LM responses are cached by request content (model, prompt, image), so
+    # repeated evals and GEPA rollouts on unchanged inputs skip the API call
+    dspy.configure_cache(
+        enable_disk_cache=True,
+        enable_memory_cache=True,
+        disk_cache_dir=str(LLM_CACHE_DIR),
+    )
+    return lm
+
+
+@lru_cache(maxsize=8)
+def _build_lm(model_name: str, temperature: float | None = None) -> dspy.LM:
+    """Create (once per model/temperature) a shared dspy.LM instance.
+
+    Reusing the instance keeps one set of HTTP connection pools across CLI
+    commands and threads.
+    """
+    kwargs = {} if temperature is None else {"temperature": temperature}
+    return dspy.LM(
         model=model_name,
+        cache=True,  # Serve repeated prompts from DSPy's cache
         num_retries=5,  # Retry on 429/5xx errors
+        **kwargs,
     )
-    dspy.configure(lm=lm)
-    return lm
 
 
 # =============================================================================
@@ -63,6 +101,8 @@ def configure_llm(provider: LLMProvider, model: str | None = None) -> dspy.LM:
 class Room(BaseModel):
     """A single room in a floorplan."""
 
+    model_config = ConfigDict(frozen=True)
+
     type: str  # e.g., "bedroom", "bathroom", "kitchen", "living_room"
     area_sqft: Optional[float] = None
 
@@ -70,6 +110,8 @@ class Room(BaseModel):
 class FloorplanData(BaseModel):
     """Structured extraction output for a floorplan."""
 
+    model_config = ConfigDict(frozen=True)
+
     rooms: list[Room]
     total_rooms: int
     has_garage: bool
@@ -116,6 +158,17 @@ class FloorplanExtractor(dspy.Module):
 
 DATA_DIR = Path("data/cubicasa5k/cubicasa5k")
 
+# Derived files written next to the dataset to speed up load_split
+LABEL_CACHE_PATH = DATA_DIR / "labels.cache.json"
+
+# Bump whenever parse_annotation's output changes so cached labels are redone
+LABEL_PARSER_VERSION = 3
+
+# Original scans and the downscaled previews written by offline_preprocess
+ORIGINAL_IMAGE_NAME = "F1_original.png"
+PREVIEW_IMAGE_NAME = "F1_preview.webp"
+PREVIEW_MAX_SIZE = (2048, 2048)
+
 # Room type mapping from CubiCasa5K SVG classes to normalized names
 ROOM_TYPE_MAP = {
     "bedroom": "bedroom",
@@ -138,18 +191,29 @@ ROOM_TYPE_MAP = {
     "undefined": "other",
 }
 
+# Raw-bytes scanners for the opt-in (strict=False) annotation path. _SPACE_RE
+# captures the whole value of any class attribute containing "Space", in
+# either quote style, inside an element start tag (never in text content).
+_SPACE_RE = re.compile(
+    rb"""<[A-Za-z][^<>]*?\sclass\s*=\s*(?:"([^"]*Space[^"]*)"|'([^']*Space[^']*)')"""
+)
+_NON_MARKUP_RE = re.compile(rb"<!--.*?-->|<!\[CDATA\[.*?\]\]>", re.S)
+_DATA_HREF_RE = re.compile(rb"""(href\s*=\s*)(?:"data:[^"]*"|'data:[^']*')""")
+
 
 def load_split(split: str, limit: Optional[int] = None) -> list[dspy.Example]:
     """Load train/val/test split from CubiCasa5K dataset.
 
     Args:
         split: One of 'train', 'val', 'test'
-        limit: Optional limit on number of examples to load
+        limit: Optional limit on number of split entries to load (entries
+            with missing files are skipped, so fewer examples may be returned)
 
     Returns:
         List of dspy.Example with:
             - floorplan_image: dspy.Image
             - extracted_data: FloorplanData (ground truth label)
+            - gold_types: frozenset of lowercased ground-truth room types
     """
     if split not in ("train", "val", "test"):
         raise ValueError(f"split must be 'train', 'val', or 'test', got {split!r}")
@@ -162,99 +226,264 @@ def load_split(split: str, limit: Optional[int] = None) -> list[dspy.Example]:
     with open(split_file) as f:
         floorplan_paths = [line.strip() for line in f if line.strip()]
 
-    examples = []
-    for rel_path in floorplan_paths:
-        if limit and len(examples) >= limit:
-            break
+    if limit:
+        floorplan_paths = floorplan_paths[:limit]
 
+    label_cache = _load_label_cache()
+    new_labels = {}
+
+    def _load_one(rel_path: str) -> Optional[dspy.Example]:
         # rel_path is like "/high_quality_architectural/6044/"
-        floorplan_dir = DATA_DIR / rel_path.strip("/")
+        floorplan_key = rel_path.strip("/")
+        floorplan_dir = DATA_DIR / floorplan_key
 
-        image_path = floorplan_dir / "F1_original.png"
         annotation_path = floorplan_dir / "model.svg"
 
-        if not image_path.exists() or not annotation_path.exists():
-            continue
+        # Checked per example so added or deleted previews are always seen
+        image_name = _find_image(floorplan_dir)
+        if image_name is None:
+            return None
+        image_path = floorplan_dir / image_name
+
+        try:
+            mtime = annotation_path.stat().st_mtime
+        except FileNotFoundError:
+            return None
 
         try:
-            label = parse_annotation(annotation_path)
+            cached = label_cache.get(floorplan_key)
+            if cached and cached["mtime"] == mtime:
+                label = _label_from_cache(cached["label"])
+            else:
+                label = parse_annotation(annotation_path)
+                new_labels[floorplan_key] = {"mtime": mtime, "label": label.model_dump()}
+
             image = dspy.Image(str(image_path))
 
-            examples.append(
-                dspy.Example(
-                    floorplan_image=image,
-                    extracted_data=label,
-                ).with_inputs("floorplan_image")
-            )
+            return dspy.Example(
+                floorplan_image=image,
+                extracted_data=label,
+                gold_types=frozenset(r.type.lower() for r in label.rooms),
+            ).with_inputs("floorplan_image")
         except Exception as e:
             # Skip problematic files
             print(f"Warning: Could not load {floorplan_dir}: {e}")
-            continue
+            return None
+
+    # Loading is I/O-bound (stat, SVG read, image read), so fan out over threads
+    max_workers = min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        examples = [ex for ex in executor.map(_load_one, floorplan_paths) if ex is not None]
+
+    if new_labels:
+        label_cache.update(new_labels)
+        _save_label_cache(label_cache)
 
     return examples
 
 
-def parse_annotation(svg_path: Path) -> FloorplanData:
+def _load_label_cache() -> dict:
+    """Load cached ground-truth labels keyed by floorplan path.
+
+    Each entry stores the model.svg mtime it was parsed from, so edited
+    annotations are re-parsed on the next load. The whole cache is dropped
+    when it was written by a different parser version or ROOM_TYPE_MAP.
+    """
+    if not LABEL_CACHE_PATH.exists():
+        return {}
+    try:
+        with open(LABEL_CACHE_PATH, "rb") as f:
+            cache = _json_loads(f.read())
+    except (OSError, ValueError) as e:
+        print(f"Warning: Ignoring unreadable label cache {LABEL_CACHE_PATH}: {e}")
+        return {}
+
+    if not isinstance(cache, dict) or cache.get("version") != _label_cache_version():
+        print(f"Discarding stale label cache {LABEL_CACHE_PATH}")
+        return {}
+    return cache["labels"]
+
+
+def _label_from_cache(data: dict) -> FloorplanData:
+    """Rebuild a cached label without validation (it came from model_dump)."""
+    rooms = [Room.model_construct(**room) for room in data["rooms"]]
+    return FloorplanData.model_construct(**{**data, "rooms": rooms})
+
+
+def _save_label_cache(label_cache: dict):
+    """Write the label cache back to disk."""
+    cache = {"version": _label_cache_version(), "labels": label_cache}
+    _write_atomic(LABEL_CACHE_PATH, json.dumps(cache))
+
+
+@lru_cache(maxsize=1)
+def _label_cache_version() -> str:
+    """Identify the parser and room mapping that produced cached labels."""
+    room_map = json.dumps(ROOM_TYPE_MAP, sort_keys=True).encode()
+    return f"{LABEL_PARSER_VERSION}:{hashlib.sha256(room_map).hexdigest()[:16]}"
+
+
+def _find_image(floorplan_dir: Path) -> Optional[str]:
+    """Return the image file name to use in floorplan_dir, if any."""
+    for name in (PREVIEW_IMAGE_NAME, ORIGINAL_IMAGE_NAME):
+        if (floorplan_dir / name).exists():
+            return name
+    return None
+
+
+def _write_atomic(path: Path, text: str):
+    """Write text to path via a temp file so readers never see a partial file."""
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def offline_preprocess(overwrite: bool = False) -> int:
+    """Write a downscaled WebP preview next to every original floorplan image.
+
+    Vision models resize large inputs anyway, so sending the preview cuts
+    upload size and provider-side processing on every run.
+
+    Args:
+        overwrite: Regenerate previews that already exist
+
+    Returns:
+        Number of previews written
+    """
+    from PIL import Image as PILImage
+
+    written = 0
+    for original_path in DATA_DIR.glob(f"*/*/{ORIGINAL_IMAGE_NAME}"):
+        preview_path = original_path.with_name(PREVIEW_IMAGE_NAME)
+        if preview_path.exists() and not overwrite:
+            continue
+
+        try:
+            with PILImage.open(original_path) as img:
+                # thumbnail() only ever shrinks, keeping aspect ratio
+                img.thumbnail(PREVIEW_MAX_SIZE)
+                img.save(preview_path, format="WEBP", quality=85)
+            written += 1
+        except OSError as e:
+            print(f"Warning: Could not preprocess {original_path}: {e}")
+
+    return written
+
+
+def parse_annotation(svg_path: Path, strict: bool = True) -> FloorplanData:
     """Parse CubiCasa5K SVG annotation to extract ground truth labels.
 
     Args:
         svg_path: Path to the annotation SVG file
+        strict: Walk the parsed SVG tree (default). Pass False to regex-scan
+            the raw bytes instead; run check-parsers to confirm both agree
+            on the dataset before relying on it
 
     Returns:
         FloorplanData with room types and counts
     """
-    tree = ET.parse(svg_path)
-    root = tree.getroot()
+    if strict:
+        room_types = _iter_room_types_xml(svg_path)
+    else:
+        room_types = _iter_room_types_raw(svg_path)
 
-    # SVG namespace handling
-    ns = {"svg": "http://www.w3.org/2000/svg"}
+    types_list = list(room_types)
+    counts = Counter(types_list)
 
-    rooms = []
-    num_bedrooms = 0
-    num_bathrooms = 0
-    has_garage = False
+    # Labels come from trusted annotations, so skip validation; LLM
+    # predictions are still validated when DSPy parses them
+    rooms = [Room.model_construct(type=t) for t in types_list]
+
+    return FloorplanData.model_construct(
+        rooms=rooms,
+        total_rooms=len(types_list),
+        has_garage="garage" in counts,
+        num_bathrooms=counts["bathroom"],
+        num_bedrooms=counts["bedroom"],
+    )
 
-    # Find all Space elements (rooms) by looking for class attributes containing "Space"
-    for elem in root.iter():
+
+def _iter_room_types_raw(svg_path: Path):
+    """Yield normalized room types by regex-scanning the raw SVG bytes."""
+    data = svg_path.read_bytes()
+
+    # Comments and CDATA are not markup; class attributes in them don't count
+    if b"<!" in data:
+        data = _NON_MARKUP_RE.sub(b"", data)
+
+    # Embedded base64 rasters can dominate file size; drop just the payloads
+    if b"data:" in data:
+        data = _DATA_HREF_RE.sub(rb'\1""', data)
+
+    for match in _SPACE_RE.finditer(data):
+        class_attr = (match.group(1) or match.group(2)).decode("utf-8", "replace")
+        if "&" in class_attr:
+            class_attr = html.unescape(class_attr)
+
+        room_type = _room_type_from_class(class_attr)
+        if room_type is not None:
+            yield room_type
+
+
+def _iter_room_types_xml(svg_path: Path):
+    """Yield normalized room types by walking the SVG with lxml."""
+    # Stream elements so the full SVG tree is never materialized; any element
+    # type may carry a Space class, so don't filter by tag
+    for _, elem in ET.iterparse(str(svg_path), events=("end",)):
         class_attr = elem.get("class", "")
+        elem.clear(keep_tail=True)
 
         # Look for Space elements which define rooms
         if "Space" in class_attr:
-            # Parse the class to extract room type
-            # Format: "Space Category Type" e.g., "Space Outdoor Terrace"
-            parts = class_attr.split()
+            room_type = _room_type_from_class(class_attr)
+            if room_type is not None:
+                yield room_type
 
-            if len(parts) >= 2:
-                # Get the room type (last meaningful part after "Space")
-                room_type_raw = parts[-1].lower() if len(parts) > 1 else "other"
 
-                # Also check category (second part) for context
-                category = parts[1].lower() if len(parts) > 2 else ""
+def _room_type_from_class(class_attr: str) -> Optional[str]:
+    """Normalize a Space class attribute to a room type (None if not a room)."""
+    # Parse the class to extract room type
+    # Format: "Space Category Type" e.g., "Space Outdoor Terrace"
+    parts = class_attr.split()
+    if len(parts) < 2:
+        return None
 
-                # Normalize the room type
-                room_type = ROOM_TYPE_MAP.get(room_type_raw, room_type_raw)
+    # Get the room type (last meaningful part after "Space")
+    room_type_raw = parts[-1].lower()
 
-                # Also map category-based types
-                if category in ROOM_TYPE_MAP:
-                    room_type = ROOM_TYPE_MAP.get(category, room_type)
+    # Also check category (second part) for context
+    category = parts[1].lower() if len(parts) > 2 else ""
 
-                rooms.append(Room(type=room_type))
+    # Category-based types take precedence; unknown types pass through
+    return ROOM_TYPE_MAP.get(category) or ROOM_TYPE_MAP.get(room_type_raw, room_type_raw)
 
-                # Count specific room types
-                if room_type == "bedroom":
-                    num_bedrooms += 1
-                elif room_type == "bathroom":
-                    num_bathrooms += 1
-                elif room_type == "garage":
-                    has_garage = True
 
-    return FloorplanData(
-        rooms=rooms,
-        total_rooms=len(rooms),
-        has_garage=has_garage,
-        num_bathrooms=num_bathrooms,
-        num_bedrooms=num_bedrooms,
-    )
+def compare_annotation_parsers(split: str, limit: Optional[int] = None) -> list[Path]:
+    """Return annotations where the raw-bytes and lxml parsers disagree.
+
+    Args:
+        split: One of 'train', 'val', 'test'
+        limit: Optional limit on number of split entries to check
+
+    Returns:
+        Paths of model.svg files whose parsed labels differ
+    """
+    with open(DATA_DIR / f"{split}.txt") as f:
+        floorplan_paths = [line.strip() for line in f if line.strip()]
+    if limit:
+        floorplan_paths = floorplan_paths[:limit]
+
+    mismatches = []
+    for rel_path in floorplan_paths:
+        annotation_path = DATA_DIR / rel_path.strip("/") / "model.svg"
+        if not annotation_path.exists():
+            continue
+        raw = parse_annotation(annotation_path, strict=False)
+        strict = parse_annotation(annotation_path, strict=True)
+        if raw.model_dump() != strict.model_dump():
+            mismatches.append(annotation_path)
+    return mismatches
 
 
 # =============================================================================
@@ -279,6 +508,9 @@ def extraction_metric(
     Returns:
         float score (0-1) for basic eval, or dict with 'score' and 'feedback' for GEPA
     """
+    # Feedback strings are only needed by GEPA, which passes a trace
+    want_feedback = trace is not None or pred_trace is not None
+
     gold_data: FloorplanData = gold.extracted_data
     # Handle both direct FloorplanData and Prediction wrapper
     if isinstance(pred, FloorplanData):
@@ -287,56 +519,55 @@ def extraction_metric(
         pred_data = pred.extracted_data
     else:
         # Fallback: return failure
-        if trace is not None:
+        if want_feedback:
             return {"score": 0.0, "feedback": f"Invalid prediction type: {type(pred)}"}
         return 0.0
 
-    score = 0.0
-    feedback = []
+    # Room, bedroom and bathroom counts (25% each)
+    rooms_match = gold_data.total_rooms == pred_data.total_rooms
+    bedrooms_match = gold_data.num_bedrooms == pred_data.num_bedrooms
+    bathrooms_match = gold_data.num_bathrooms == pred_data.num_bathrooms
 
-    # Check room count match (25%)
-    if gold_data.total_rooms == pred_data.total_rooms:
-        score += 0.25
+    # Room type coverage (25%)
+    # load_split precomputes this; fall back for hand-built examples
+    gold_types = getattr(gold, "gold_types", None)
+    if gold_types is None:
+        gold_types = {r.type.lower() for r in gold_data.rooms}
+    pred_types = {r.type.lower() for r in pred_data.rooms}
+    if gold_types:
+        overlap = len(gold_types & pred_types) / len(gold_types)
     else:
+        overlap = 1.0  # No rooms to match
+
+    score = 0.25 * (rooms_match + bedrooms_match + bathrooms_match + overlap)
+
+    # Float for basic eval; skip formatting feedback nobody will read
+    if not want_feedback:
+        return score
+
+    feedback = []
+    if not rooms_match:
         feedback.append(
             f"Room count mismatch: expected {gold_data.total_rooms}, got {pred_data.total_rooms}"
         )
-
-    # Check bedroom count (25%)
-    if gold_data.num_bedrooms == pred_data.num_bedrooms:
-        score += 0.25
-    else:
+    if not bedrooms_match:
         feedback.append(
             f"Bedroom count mismatch: expected {gold_data.num_bedrooms}, got {pred_data.num_bedrooms}"
         )
-
-    # Check bathroom count (25%)
-    if gold_data.num_bathrooms == pred_data.num_bathrooms:
-        score += 0.25
-    else:
+    if not bathrooms_match:
         feedback.append(
             f"Bathroom count mismatch: expected {gold_data.num_bathrooms}, got {pred_data.num_bathrooms}"
         )
+    if overlap < 1.0:
+        # set() keeps the text GEPA reflects on as "{...}", not "frozenset({...})"
+        missing = set(gold_types - pred_types)
+        feedback.append(f"Missing room types: {missing}")
 
-    # Check room type coverage (25%)
-    gold_types = {r.type.lower() for r in gold_data.rooms}
-    pred_types = {r.type.lower() for r in pred_data.rooms}
-    if gold_types:
-        overlap = len(gold_types & pred_types) / len(gold_types)
-        score += 0.25 * overlap
-        if overlap < 1.0:
-            missing = gold_types - pred_types
-            feedback.append(f"Missing room types: {missing}")
-    else:
-        score += 0.25  # No rooms to match
-
-    # Return dict for GEPA (when trace is provided), float for basic eval
-    if trace is not None or pred_trace is not None:
-        return {
-            "score": score,
-            "feedback": "\n".join(feedback) if feedback else "Good extraction",
-        }
-    return score
+    # Dict for GEPA (when trace is provided)
+    return {
+        "score": score,
+        "feedback": "\n".join(feedback) if feedback else "Good extraction",
+    }
 
 
 def optimize_with_gepa(
@@ -345,6 +576,8 @@ def optimize_with_gepa(
     budget: str = "medium",
     provider: LLMProvider = LLMProvider.GEMINI,
     num_threads: int = 4,
+    log_dir: str | None = None,
+    patience: int | None = None,
 ) -> FloorplanExtractor:
     """Optimize FloorplanExtractor using GEPA.
 
@@ -354,17 +587,27 @@ def optimize_with_gepa(
         budget: GEPA budget preset ("light", "medium", "heavy")
         provider: LLM provider for reflection
         num_threads: Number of parallel threads for evaluation
+        log_dir: Directory where GEPA checkpoints its state every iteration;
+            if it already holds a run, optimization resumes from it
+        patience: Stop early after this many iterations without a better
+            validation score
 
     Returns:
         Optimized FloorplanExtractor module
     """
+    gepa_kwargs = {}
+    if patience:
+        gepa_kwargs["stop_callbacks"] = NoImprovementStopper(patience)
+
     reflection_model = PROVIDER_MODELS[provider]
     optimizer = dspy.GEPA(
         metric=extraction_metric,
         auto=budget,
-        reflection_lm=dspy.LM(model=reflection_model, temperature=1.0, num_retries=5),
+        reflection_lm=_build_lm(reflection_model, temperature=1.0),
         num_threads=num_threads,
         track_stats=True,
+        log_dir=log_dir,
+        gepa_kwargs=gepa_kwargs,
     )
 
     optimized = optimizer.compile(
@@ -381,30 +624,42 @@ def optimize_with_gepa(
 # =============================================================================
 
 
-def evaluate(extractor: FloorplanExtractor, split: str = "test") -> dict:
+def evaluate(
+    extractor: FloorplanExtractor,
+    split: str = "test",
+    limit: Optional[int] = None,
+    num_threads: int = 4,
+) -> dict:
     """Evaluate extractor on a data split.
 
     Args:
         extractor: The FloorplanExtractor to evaluate
         split: Which split to evaluate on ('train', 'val', 'test')
+        limit: Optional limit on number of examples to evaluate
+        num_threads: Number of parallel threads for LLM calls
 
     Returns:
         Dict with aggregate metrics
     """
-    testset = load_split(split)
+    testset = load_split(split, limit=limit)
 
     if not testset:
         raise ValueError(f"No examples found for split '{split}'")
 
-    total_score = 0.0
-    results = []
+    # LLM calls are network-bound, so run them concurrently
+    evaluator = dspy.Evaluate(
+        devset=testset,
+        metric=extraction_metric,
+        num_threads=num_threads,
+        display_progress=True,
+    )
+    evaluation = evaluator(extractor)
 
-    for example in testset:
-        pred = extractor(floorplan_image=example.floorplan_image)
-        pred_example = dspy.Prediction(extracted_data=pred)
-        metric_result = extraction_metric(example, pred_example)
-        total_score += metric_result["score"]
-        results.append(metric_result)
+    results = [
+        {"score": float(score), "prediction": pred}
+        for _, pred, score in evaluation.results
+    ]
+    total_score = sum(r["score"] for r in results)
 
     return {
         "split": split,
@@ -430,16 +685,13 @@ def load_model(path: str = "optimized_extractor") -> FloorplanExtractor:
 
     Supports both DSPy native format and custom state.json format.
     """
-    import json
-    from pathlib import Path
-
     extractor = FloorplanExtractor()
     state_path = Path(path) / "state.json"
 
     if state_path.exists():
         # Load from our custom state.json format
-        with open(state_path) as f:
-            state = json.load(f)
+        with open(state_path, "rb") as f:
+            state = _json_loads(f.read())
 
         # Apply the optimized instruction to the predictor
         if "extractor" in state and "predict" in state["extractor"]:
@@ -465,6 +717,9 @@ from dotenv import load_dotenv
 
 app = typer.Typer(help="Floorplan structured extraction with DSPy + GEPA")
 
+# Each fresh optimize run checkpoints into a timestamped subdirectory
+CHECKPOINT_ROOT = Path("gepa_checkpoints")
+
 
 @app.command()
 def optimize(
@@ -474,11 +729,38 @@ def optimize(
     val_limit: int = typer.Option(20, help="Max validation examples"),
     threads: int = typer.Option(4, help="Parallel threads"),
     output: str = typer.Option("optimized_extractor", help="Output path for saved model"),
+    resume: Optional[str] = typer.Option(
+        None, help="Resume the GEPA run checkpointed in this directory"
+    ),
+    patience: int = typer.Option(
+        0,
+        help="Stop after N iterations without improvement (0 = off); "
+        "the count restarts from zero on --resume",
+    ),
 ):
     """Run GEPA optimization on the floorplan extractor."""
     load_dotenv()
 
-    llm_provider = LLMProvider(provider)
+    # Validate arguments before creating any checkpoint directory
+    try:
+        llm_provider = LLMProvider(provider)
+    except ValueError:
+        raise typer.BadParameter(f"Unknown provider {provider!r}", param_hint="--provider")
+    if budget not in ("light", "medium", "heavy"):
+        raise typer.BadParameter(f"Unknown budget {budget!r}", param_hint="--budget")
+
+    # Fresh runs checkpoint into their own directory; resuming is opt-in
+    # because GEPA does not check a saved run against the current data/budget
+    if resume:
+        checkpoint_dir = Path(resume)
+        if not (checkpoint_dir / "gepa_state.bin").exists():
+            raise typer.BadParameter(f"No GEPA checkpoint found in {checkpoint_dir}/")
+        print(f"Resuming GEPA run from {checkpoint_dir}/")
+    else:
+        checkpoint_dir = CHECKPOINT_ROOT / datetime.now().strftime("%Y%m%d-%H%M%S")
+        checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        print(f"Checkpointing GEPA run to {checkpoint_dir}/")
+
     configure_llm(llm_provider)
     print(f"Using LLM: {PROVIDER_MODELS[llm_provider]}")
 
@@ -489,7 +771,13 @@ def optimize(
 
     print(f"\nOptimizing with GEPA (budget={budget}, threads={threads})...")
     optimized = optimize_with_gepa(
-        trainset, valset, budget=budget, provider=llm_provider, num_threads=threads
+        trainset,
+        valset,
+        budget=budget,
+        provider=llm_provider,
+        num_threads=threads,
+        log_dir=str(checkpoint_dir),
+        patience=patience or None,
     )
 
     save_model(optimized, output)
@@ -502,6 +790,7 @@ def eval(
     model_path: str = typer.Option("optimized_extractor", help="Path to saved model"),
     split: str = typer.Option("test", help="Split to evaluate: train, val, test"),
     limit: int = typer.Option(50, help="Max examples to evaluate"),
+    threads: int = typer.Option(4, help="Parallel threads"),
 ):
     """Evaluate a saved model on a data split."""
     load_dotenv()
@@ -512,11 +801,35 @@ def eval(
     print(f"Loading model from {model_path}/...")
     extractor = load_model(model_path)
 
-    print(f"Evaluating on {split} (limit={limit})...")
-    results = evaluate(extractor, split=split)
+    print(f"Evaluating on {split} (limit={limit}, threads={threads})...")
+    results = evaluate(extractor, split=split, limit=limit, num_threads=threads)
     print(f"\nResults: {results['avg_score']:.2%} average score")
 
 
+@app.command()
+def preprocess(
+    overwrite: bool = typer.Option(False, help="Regenerate existing previews"),
+):
+    """Write downscaled WebP previews of the dataset images."""
+    print(f"Preprocessing images under {DATA_DIR}/...")
+    written = offline_preprocess(overwrite=overwrite)
+    print(f"Wrote {written} previews")
+
+
+@app.command()
+def check_parsers(
+    split: str = typer.Option("train", help="Split to check: train, val, test"),
+    limit: int = typer.Option(0, help="Max annotations to check (0 = all)"),
+):
+    """Check that the fast and strict SVG annotation parsers agree."""
+    mismatches = compare_annotation_parsers(split, limit=limit or None)
+    for annotation_path in mismatches:
+        print(f"Mismatch: {annotation_path}")
+    print(f"{len(mismatches)} annotations differ between parsers")
+    if mismatches:
+        raise typer.Exit(code=1)
+
+
 @app.command()
 def test_single(
     image_path: str = typer.Argument(..., help="Path to floorplan image"),